@@ -4,8 +4,14 @@ Handles image upload, geocoding, format conversion, and EXIF injection.
 """
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import ORJSONResponse, Response
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from tempfile import SpooledTemporaryFile
+import asyncio
+import logging
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 from services.geocoding import GeocodingService
@@ -15,15 +21,52 @@ from services.exif_handler import read_gps_from_exif
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Upload limits: uploads are streamed in chunks and spooled to disk past
+# UPLOAD_SPOOL_SIZE, and rejected once they exceed MAX_UPLOAD_SIZE
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 25 * 1024 * 1024))
+UPLOAD_SPOOL_SIZE = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_TOO_LARGE_DETAIL = f"File too large. Maximum size is {MAX_UPLOAD_SIZE // (1024 * 1024)} MB."
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the image processing pool and geocoding client at startup, close them on exit."""
+    # Pillow releases the GIL while decoding/encoding, so threads run image
+    # work in parallel without pickling uploads across processes.
+    app.state.pool = ThreadPoolExecutor(
+        max_workers=int(os.getenv("IMAGE_WORKERS", os.cpu_count() or 1)),
+        thread_name_prefix="image-processor"
+    )
+    geocoding_service.open()
+    try:
+        yield
+    finally:
+        app.state.pool.shutdown(wait=True)
+        geocoding_service.close()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="EXIF Metadata Editor API",
     description="API for modifying image EXIF metadata (GPS location and format conversion)",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Configure CORS
-allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
+# Configure CORS (origins are parsed once here, not per request)
+allowed_origins = [
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
+if "*" in allowed_origins:
+    # A bare wildcard lets Starlette skip per-origin matching entirely
+    logger.info("ALLOWED_ORIGINS contains '*', allowing all origins")
+    allowed_origins = ["*"]
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -57,7 +100,9 @@ async def health_check():
 async def process_image(
     file: UploadFile = File(..., description="Image file to process"),
     address: str = Form(..., description="Target address for GPS coordinates"),
-    format: str = Form(..., description="Output format: jpeg, png, or webp")
+    format: str = Form(..., description="Output format: jpeg, png, or webp"),
+    compression: str = Form("fast", description="Compression preset: fast or best"),
+    max_dimension: Optional[int] = Form(None, description="Optional maximum output width/height in pixels")
 ):
     """
     Process an image: add GPS metadata and convert format.
@@ -66,27 +111,54 @@ async def process_image(
         file: Uploaded image file
         address: Address to convert to GPS coordinates
         format: Desired output format
+        compression: "fast" (default) for quick encodes, "best" for smaller files
+        max_dimension: Optional bound for the output width and height
         
     Returns:
         Processed image with GPS EXIF data
         
     Raises:
         400: Invalid input (bad format, empty address, etc.)
+        413: Uploaded file is too large
+        415: Uploaded file is not an image
         422: Cannot geocode address
         500: Internal processing error
     """
+    spool = None
     try:
-        # Validate file
+        # Validate file before reading any of it
         if not file.content_type or not file.content_type.startswith("image/"):
             raise HTTPException(
-                status_code=400,
+                status_code=415,
                 detail="Invalid file type. Please upload an image file."
             )
         
-        # Read image bytes
-        image_bytes = await file.read()
+        if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=UPLOAD_TOO_LARGE_DETAIL
+            )
+        
+        if file.size == 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Empty file uploaded."
+            )
+        
+        # Stream the upload into a bounded spool instead of one big bytes object
+        spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+        total_size = 0
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            total_size += len(chunk)
+            if total_size > MAX_UPLOAD_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=UPLOAD_TOO_LARGE_DETAIL
+                )
+            spool.write(chunk)
+        spool.seek(0)
         
-        if len(image_bytes) == 0:
+        if total_size == 0:
             raise HTTPException(
                 status_code=400,
                 detail="Empty file uploaded."
@@ -101,7 +173,7 @@ async def process_image(
         
         # Geocode address
         try:
-            coordinates = geocoding_service.get_coordinates(address)
+            coordinates = await geocoding_service.get_coordinates(address)
             if not coordinates:
                 raise HTTPException(
                     status_code=422,
@@ -117,13 +189,18 @@ async def process_image(
                 detail=f"Geocoding error: {str(e)}"
             )
         
-        # Process image
+        # Process image (CPU-bound, run in the image processing pool)
         try:
-            processed_bytes, mime_type = image_processor.process_image(
-                image_bytes,
+            loop = asyncio.get_running_loop()
+            processed_bytes, mime_type = await loop.run_in_executor(
+                app.state.pool,
+                image_processor.process_image,
+                spool,
                 latitude,
                 longitude,
-                format
+                format,
+                compression,
+                max_dimension
             )
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
@@ -156,6 +233,9 @@ async def process_image(
             status_code=500,
             detail=f"Unexpected error: {str(e)}"
         )
+    finally:
+        if spool is not None:
+            spool.close()
 
 
 @app.post("/get-coordinates")
@@ -177,7 +257,7 @@ async def get_coordinates(address: str = Form(...)):
                 detail="Address cannot be empty."
             )
         
-        coordinates = geocoding_service.get_coordinates(address)
+        coordinates = await geocoding_service.get_coordinates(address)
         
         if not coordinates:
             raise HTTPException(
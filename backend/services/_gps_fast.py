@@ -0,0 +1,70 @@
+"""
+Fast conversion of GPS EXIF rationals (degrees, minutes, seconds) to decimal degrees.
+Compiled with Numba when it is installed, plain Python/NumPy otherwise.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Optional dependency, only used to speed up batch scans
+    numba = None
+
+
+def _njit(**options):
+    """Compile with numba.njit when available, otherwise leave the function as is."""
+    if numba is None:
+        return lambda func: func
+    return numba.njit(cache=True, fastmath=True, **options)
+
+
+@_njit()
+def rat_to_deg(n0, d0, n1, d1, n2, d2):
+    """
+    Convert degrees, minutes and seconds rationals to decimal degrees.
+    
+    Args:
+        n0, d0: Degrees numerator and denominator
+        n1, d1: Minutes numerator and denominator
+        n2, d2: Seconds numerator and denominator
+    
+    Returns:
+        Unsigned decimal degrees
+    """
+    return n0 / d0 + n1 / (d1 * 60.0) + n2 / (d2 * 3600.0)
+
+
+if numba is not None:
+    @_njit(parallel=True)
+    def _rat_to_deg_batch(rationals):
+        result = np.empty(rationals.shape[0], dtype=np.float64)
+        for i in numba.prange(rationals.shape[0]):
+            result[i] = (rationals[i, 0] / rationals[i, 1]
+                         + rationals[i, 2] / (rationals[i, 3] * 60.0)
+                         + rationals[i, 4] / (rationals[i, 5] * 3600.0))
+        return result
+else:
+    def _rat_to_deg_batch(rationals):
+        rationals = rationals.astype(np.float64)
+        return (rationals[:, 0] / rationals[:, 1]
+                + rationals[:, 2] / (rationals[:, 3] * 60.0)
+                + rationals[:, 4] / (rationals[:, 5] * 3600.0))
+
+
+def rat_to_deg_batch(rationals) -> np.ndarray:
+    """
+    Convert many GPS coordinates at once, e.g. when indexing a gallery.
+    
+    Args:
+        rationals: Array-like of shape (N, 6) holding
+            (deg_num, deg_den, min_num, min_den, sec_num, sec_den) per row
+    
+    Returns:
+        Array of shape (N,) with unsigned decimal degrees
+    
+    Raises:
+        ValueError: If the input does not have shape (N, 6)
+    """
+    rationals = np.ascontiguousarray(rationals, dtype=np.int64)
+    if rationals.ndim != 2 or rationals.shape[1] != 6:
+        raise ValueError(f"Expected an array of shape (N, 6), got {rationals.shape}")
+    return _rat_to_deg_batch(rationals)
@@ -2,8 +2,69 @@
 EXIF metadata handler for reading and writing GPS data to images.
 """
 import piexif
+import struct
 from typing import Tuple, Dict, Any, Optional
-from fractions import Fraction
+from ._gps_fast import rat_to_deg
+
+# Seconds are stored as a rational with this denominator (1e-7 arc-second)
+SECONDS_DENOMINATOR = 10_000_000
+
+EXIF_HEADER = b"Exif\x00\x00"
+
+# TIFF tags and field types used by the GPS-only reader/writer
+_TAG_GPS_IFD_POINTER = 0x8825
+_TAG_GPS_VERSION_ID = 0
+_TAG_GPS_LATITUDE_REF = 1
+_TAG_GPS_LATITUDE = 2
+_TAG_GPS_LONGITUDE_REF = 3
+_TAG_GPS_LONGITUDE = 4
+_TYPE_BYTE = 1
+_TYPE_ASCII = 2
+_TYPE_LONG = 4
+_TYPE_RATIONAL = 5
+_TYPE_SRATIONAL = 10
+
+# Layout of the GPS-only EXIF block written by build_gps_exif_bytes
+# (offsets are relative to the TIFF header, little-endian):
+#   0   TIFF header, 0th IFD at 8
+#   8   0th IFD: 1 entry (GPS IFD pointer -> 26)
+#   26  GPS IFD: 5 entries (version, lat ref, lat, lon ref, lon)
+#   92  latitude rationals (3 x num/den)
+#   116 longitude rationals (3 x num/den)
+_GPS_IFD_OFFSET = 26
+_GPS_LATITUDE_OFFSET = 92
+_GPS_LONGITUDE_OFFSET = 116
+
+# The block is built once with placeholder values; only the two reference
+# letters and the twelve rational fields change between calls
+_GPS_EXIF_TEMPLATE = EXIF_HEADER + struct.pack(
+    "<2sHI"              # TIFF header
+    "H HHII I"           # 0th IFD
+    "H HHI4s HHI4s HHII HHI4s HHII I"  # GPS IFD
+    "6I 6I",             # latitude / longitude rationals
+    b"II", 42, 8,
+    # 0th IFD
+    1,
+    _TAG_GPS_IFD_POINTER, _TYPE_LONG, 1, _GPS_IFD_OFFSET,
+    0,
+    # GPS IFD
+    5,
+    _TAG_GPS_VERSION_ID, _TYPE_BYTE, 4, bytes((2, 3, 0, 0)),
+    _TAG_GPS_LATITUDE_REF, _TYPE_ASCII, 2, b"N",
+    _TAG_GPS_LATITUDE, _TYPE_RATIONAL, 3, _GPS_LATITUDE_OFFSET,
+    _TAG_GPS_LONGITUDE_REF, _TYPE_ASCII, 2, b"E",
+    _TAG_GPS_LONGITUDE, _TYPE_RATIONAL, 3, _GPS_LONGITUDE_OFFSET,
+    0,
+    # Rationals
+    *([0, 1] * 6)
+)
+
+# Byte offsets of the variable fields inside _GPS_EXIF_TEMPLATE
+# (GPS IFD entries are 12 bytes, their value field starts at byte 8)
+_TEMPLATE_LATITUDE_REF_OFFSET = len(EXIF_HEADER) + _GPS_IFD_OFFSET + 2 + 12 * 1 + 8
+_TEMPLATE_LONGITUDE_REF_OFFSET = len(EXIF_HEADER) + _GPS_IFD_OFFSET + 2 + 12 * 3 + 8
+_TEMPLATE_RATIONALS_OFFSET = len(EXIF_HEADER) + _GPS_LATITUDE_OFFSET
+_TEMPLATE_RATIONALS_STRUCT = struct.Struct("<12I")
 
 
 def decimal_to_dms(decimal: float, is_latitude: bool = True) -> Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int], str]:
@@ -24,24 +85,14 @@ def decimal_to_dms(decimal: float, is_latitude: bool = True) -> Tuple[Tuple[int,
     else:
         direction = 'E' if decimal >= 0 else 'W'
     
-    # Work with absolute value
-    decimal = abs(decimal)
-    
-    # Extract degrees, minutes, seconds
-    degrees = int(decimal)
-    minutes_decimal = (decimal - degrees) * 60
-    minutes = int(minutes_decimal)
-    seconds = (minutes_decimal - minutes) * 60
+    # Scale to integer units of 1e-7 arc-second once, then split with
+    # integer divmods so no precision is lost to repeated float truncation
+    scaled = int(round(abs(decimal) * 3600 * SECONDS_DENOMINATOR))
+    degrees, remainder = divmod(scaled, 3600 * SECONDS_DENOMINATOR)
+    minutes, seconds_scaled = divmod(remainder, 60 * SECONDS_DENOMINATOR)
     
     # Convert to rational format (numerator, denominator)
-    # Using Fraction to get exact rational representation
-    degrees_rational = (degrees, 1)
-    minutes_rational = (minutes, 1)
-    
-    # For seconds, use higher precision (multiply by 10000 and divide)
-    seconds_rational = (int(seconds * 10000), 10000)
-    
-    return (degrees_rational, minutes_rational, seconds_rational, direction)
+    return ((degrees, 1), (minutes, 1), (seconds_scaled, SECONDS_DENOMINATOR), direction)
 
 
 def create_gps_ifd(latitude: float, longitude: float) -> Dict[int, Any]:
@@ -70,6 +121,35 @@ def create_gps_ifd(latitude: float, longitude: float) -> Dict[int, Any]:
     return gps_ifd
 
 
+def build_gps_exif_bytes(latitude: float, longitude: float) -> bytes:
+    """
+    Build a GPS-only EXIF block, without needing an input image.
+    
+    The block is a copy of a prebuilt fixed-layout template (0th IFD pointing
+    to a GPS IFD) with only the coordinate fields patched in, instead of going
+    through piexif's generic tag tables.
+    
+    Args:
+        latitude: Latitude in decimal degrees
+        longitude: Longitude in decimal degrees
+    
+    Returns:
+        EXIF bytes ready to be passed to Image.save(exif=...)
+    """
+    lat_deg, lat_min, lat_sec, lat_ref = decimal_to_dms(latitude, is_latitude=True)
+    lon_deg, lon_min, lon_sec, lon_ref = decimal_to_dms(longitude, is_latitude=False)
+    
+    buffer = bytearray(_GPS_EXIF_TEMPLATE)
+    buffer[_TEMPLATE_LATITUDE_REF_OFFSET] = ord(lat_ref)
+    buffer[_TEMPLATE_LONGITUDE_REF_OFFSET] = ord(lon_ref)
+    _TEMPLATE_RATIONALS_STRUCT.pack_into(
+        buffer, _TEMPLATE_RATIONALS_OFFSET,
+        *lat_deg, *lat_min, *lat_sec,
+        *lon_deg, *lon_min, *lon_sec
+    )
+    return bytes(buffer)
+
+
 def add_gps_to_image(image_bytes: bytes, latitude: float, longitude: float) -> bytes:
     """
     Add GPS coordinates to image EXIF data.
@@ -99,10 +179,244 @@ def add_gps_to_image(image_bytes: bytes, latitude: float, longitude: float) -> b
     return exif_bytes
 
 
+# JPEG segments dropped before splicing: APP1 holds Exif and XMP (including
+# extended XMP), APP13 holds Photoshop/IPTC records; either may carry a location
+_JPEG_METADATA_MARKERS = (0xE1, 0xED)
+# WEBP chunks dropped before splicing, and the matching VP8X flags
+_WEBP_METADATA_CHUNKS = (b"EXIF", b"XMP ")
+_VP8X_FLAG_XMP = 0x04
+_VP8X_FLAG_EXIF = 0x08
+_VP8X_FLAG_ALPHA = 0x10
+
+
+def replace_exif(data: bytes, exif_bytes: bytes) -> Optional[bytes]:
+    """
+    Replace all location-carrying metadata in a JPEG or WEBP file with new EXIF.
+    
+    Every Exif, XMP and IPTC block is removed (not only the first one, as
+    piexif does), so no copy of the original location survives. The
+    compressed image data is copied unchanged.
+    
+    Args:
+        data: JPEG or WEBP file bytes
+        exif_bytes: EXIF bytes to insert, starting with the "Exif\\0\\0" header
+    
+    Returns:
+        The new file bytes, or None if the file is malformed or not JPEG/WEBP
+    """
+    try:
+        if data[:2] == b"\xff\xd8":
+            return _replace_jpeg_exif(data, exif_bytes)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _replace_webp_exif(data, exif_bytes)
+    except struct.error:
+        pass
+    return None
+
+
+def _replace_jpeg_exif(data: bytes, exif_bytes: bytes) -> Optional[bytes]:
+    """Rebuild a JPEG header without Exif/XMP/IPTC, then insert one Exif APP1."""
+    if len(exif_bytes) + 2 > 0xFFFF:
+        return None
+    
+    segments = []
+    offset = 2
+    while True:
+        if offset + 4 > len(data) or data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan: the entropy-coded data and trailer are kept as is
+            break
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            return None
+        (length,) = struct.unpack_from(">H", data, offset + 2)
+        end = offset + 2 + length
+        if length < 2 or end > len(data):
+            return None
+        if marker not in _JPEG_METADATA_MARKERS:
+            segments.append(data[offset:end])
+        offset = end
+    
+    # Exif goes right after SOI, or after APP0 (JFIF) when the file starts with one
+    exif_segment = b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+    insert_at = 1 if segments and segments[0][1] == 0xE0 else 0
+    segments.insert(insert_at, exif_segment)
+    return b"\xff\xd8" + b"".join(segments) + data[offset:]
+
+
+def _webp_canvas(fourcc: bytes, payload: bytes) -> Optional[Tuple[int, int, bool]]:
+    """Read (width, height, has_alpha) from a simple-format VP8/VP8L bitstream."""
+    if fourcc == b"VP8 " and payload[3:6] == b"\x9d\x01\x2a":
+        width, height = struct.unpack_from("<HH", payload, 6)
+        return width & 0x3FFF, height & 0x3FFF, False
+    if fourcc == b"VP8L" and payload[:1] == b"\x2f":
+        (bits,) = struct.unpack_from("<I", payload, 1)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool(bits >> 28 & 1)
+    return None
+
+
+def _replace_webp_exif(data: bytes, exif_bytes: bytes) -> Optional[bytes]:
+    """Rebuild a WEBP file without EXIF/XMP chunks, then append one EXIF chunk."""
+    chunks = []
+    offset = 12
+    riff_end = min(len(data), 8 + struct.unpack_from("<I", data, 4)[0])
+    while offset + 8 <= riff_end:
+        fourcc = data[offset:offset + 4]
+        (size,) = struct.unpack_from("<I", data, offset + 4)
+        end = offset + 8 + size
+        if end > riff_end:
+            return None
+        if fourcc not in _WEBP_METADATA_CHUNKS:
+            chunks.append([fourcc, data[offset + 8:end]])
+        offset = end + (size & 1)
+    if not chunks:
+        return None
+    
+    if chunks[0][0] == b"VP8X":
+        vp8x = bytearray(chunks[0][1])
+        if len(vp8x) < 10:
+            return None
+        vp8x[0] = (vp8x[0] & ~_VP8X_FLAG_XMP) | _VP8X_FLAG_EXIF
+        chunks[0][1] = bytes(vp8x)
+    else:
+        # Simple format: metadata needs an extended (VP8X) header
+        canvas = _webp_canvas(*chunks[0])
+        if canvas is None:
+            return None
+        width, height, has_alpha = canvas
+        flags = _VP8X_FLAG_EXIF | (_VP8X_FLAG_ALPHA if has_alpha else 0)
+        vp8x = struct.pack("<I", flags) + struct.pack("<I", width - 1)[:3] + struct.pack("<I", height - 1)[:3]
+        chunks.insert(0, [b"VP8X", vp8x])
+    
+    # EXIF chunk payload is the bare TIFF structure
+    if exif_bytes[:6] == EXIF_HEADER:
+        exif_bytes = exif_bytes[6:]
+    chunks.append([b"EXIF", exif_bytes])
+    
+    body = b"".join(
+        fourcc + struct.pack("<I", len(payload)) + payload + b"\x00" * (len(payload) & 1)
+        for fourcc, payload in chunks
+    )
+    return b"RIFF" + struct.pack("<I", len(body) + 4) + b"WEBP" + body
+
+
+def _find_tiff(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Locate the TIFF (EXIF) structure inside a JPEG, WEBP or raw EXIF blob.
+    
+    Args:
+        data: Image or EXIF bytes
+    
+    Returns:
+        Tuple of (start, end) offsets of the TIFF structure, or None if absent
+    """
+    if data[:2] == b"\xff\xd8":
+        # JPEG: walk marker segments up to the start of scan, looking for APP1
+        offset = 2
+        while offset + 4 <= len(data):
+            if data[offset] != 0xFF:
+                return None
+            marker = data[offset + 1]
+            if marker == 0xFF:
+                offset += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                offset += 2
+                continue
+            if marker in (0xD9, 0xDA):
+                return None
+            (length,) = struct.unpack_from(">H", data, offset + 2)
+            if marker == 0xE1 and data[offset + 4:offset + 10] == EXIF_HEADER:
+                return offset + 10, offset + 2 + length
+            offset += 2 + length
+        return None
+    
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        # WEBP: walk RIFF chunks looking for EXIF
+        offset = 12
+        while offset + 8 <= len(data):
+            fourcc = data[offset:offset + 4]
+            (size,) = struct.unpack_from("<I", data, offset + 4)
+            if fourcc == b"EXIF":
+                start = offset + 8
+                if data[start:start + 6] == EXIF_HEADER:
+                    start += 6
+                return start, offset + 8 + size
+            offset += 8 + size + (size & 1)
+        return None
+    
+    if data[:6] == EXIF_HEADER:
+        return 6, len(data)
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return 0, len(data)
+    return None
+
+
+def _read_gps_rationals(data: bytes) -> Optional[Dict[int, Any]]:
+    """
+    Read the GPS latitude/longitude tags without parsing the other IFDs.
+    
+    Args:
+        data: Image or EXIF bytes
+    
+    Returns:
+        Dictionary mapping GPS tags (1-4) to their values (ASCII refs as bytes,
+        coordinates as three (numerator, denominator) pairs), or None if the
+        image has no GPS IFD
+    """
+    bounds = _find_tiff(data)
+    if bounds is None:
+        return None
+    start, end = bounds
+    tiff = data[start:end]
+    
+    if tiff[:2] == b"II":
+        byte_order = "<"
+    elif tiff[:2] == b"MM":
+        byte_order = ">"
+    else:
+        return None
+    entry_format = byte_order + "HHI4s"
+    
+    # Find the GPS IFD pointer in the 0th IFD
+    (ifd_offset,) = struct.unpack_from(byte_order + "I", tiff, 4)
+    (entry_count,) = struct.unpack_from(byte_order + "H", tiff, ifd_offset)
+    gps_offset = None
+    for i in range(entry_count):
+        tag, _, _, value = struct.unpack_from(entry_format, tiff, ifd_offset + 2 + 12 * i)
+        if tag == _TAG_GPS_IFD_POINTER:
+            (gps_offset,) = struct.unpack_from(byte_order + "I", value)
+            break
+    if gps_offset is None:
+        return None
+    
+    # Read the four GPS position tags
+    gps_data = {}
+    (entry_count,) = struct.unpack_from(byte_order + "H", tiff, gps_offset)
+    for i in range(entry_count):
+        tag, field_type, count, value = struct.unpack_from(entry_format, tiff, gps_offset + 2 + 12 * i)
+        if tag in (_TAG_GPS_LATITUDE_REF, _TAG_GPS_LONGITUDE_REF) and field_type == _TYPE_ASCII:
+            gps_data[tag] = value[:1]
+        elif (tag in (_TAG_GPS_LATITUDE, _TAG_GPS_LONGITUDE)
+              and field_type in (_TYPE_RATIONAL, _TYPE_SRATIONAL) and count == 3):
+            (value_offset,) = struct.unpack_from(byte_order + "I", value)
+            rational_format = byte_order + ("6I" if field_type == _TYPE_RATIONAL else "6i")
+            n0, d0, n1, d1, n2, d2 = struct.unpack_from(rational_format, tiff, value_offset)
+            gps_data[tag] = ((n0, d0), (n1, d1), (n2, d2))
+    return gps_data
+
+
 def read_gps_from_exif(image_bytes: bytes) -> Optional[Dict[str, float]]:
     """
     Read GPS coordinates from image EXIF data.
     
+    Only the GPS IFD is parsed; the other IFDs and the thumbnail are skipped.
+    
     Args:
         image_bytes: Image bytes to read from
         
@@ -110,33 +424,27 @@ def read_gps_from_exif(image_bytes: bytes) -> Optional[Dict[str, float]]:
         Dictionary with 'latitude' and 'longitude' keys, or None if no GPS data
     """
     try:
-        exif_dict = piexif.load(image_bytes)
+        gps_data = _read_gps_rationals(image_bytes)
         
-        if "GPS" not in exif_dict or not exif_dict["GPS"]:
+        if not gps_data:
             return None
         
-        gps_data = exif_dict["GPS"]
-        
         # Check if GPS coordinates exist
-        if (piexif.GPSIFD.GPSLatitude not in gps_data or 
-            piexif.GPSIFD.GPSLongitude not in gps_data):
+        if (_TAG_GPS_LATITUDE not in gps_data or 
+            _TAG_GPS_LONGITUDE not in gps_data):
             return None
         
         # Extract latitude
-        lat = gps_data[piexif.GPSIFD.GPSLatitude]
-        lat_ref = gps_data[piexif.GPSIFD.GPSLatitudeRef].decode('ascii')
-        latitude = (lat[0][0] / lat[0][1] + 
-                   lat[1][0] / lat[1][1] / 60 + 
-                   lat[2][0] / lat[2][1] / 3600)
+        lat = gps_data[_TAG_GPS_LATITUDE]
+        lat_ref = gps_data[_TAG_GPS_LATITUDE_REF].decode('ascii')
+        latitude = rat_to_deg(lat[0][0], lat[0][1], lat[1][0], lat[1][1], lat[2][0], lat[2][1])
         if lat_ref == 'S':
             latitude = -latitude
         
         # Extract longitude
-        lon = gps_data[piexif.GPSIFD.GPSLongitude]
-        lon_ref = gps_data[piexif.GPSIFD.GPSLongitudeRef].decode('ascii')
-        longitude = (lon[0][0] / lon[0][1] + 
-                    lon[1][0] / lon[1][1] / 60 + 
-                    lon[2][0] / lon[2][1] / 3600)
+        lon = gps_data[_TAG_GPS_LONGITUDE]
+        lon_ref = gps_data[_TAG_GPS_LONGITUDE_REF].decode('ascii')
+        longitude = rat_to_deg(lon[0][0], lon[0][1], lon[1][0], lon[1][1], lon[2][0], lon[2][1])
         if lon_ref == 'W':
             longitude = -longitude
         
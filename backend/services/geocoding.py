@@ -1,30 +1,149 @@
 """
 Geocoding service for converting addresses to GPS coordinates.
-Uses OpenStreetMap's Nominatim service via geopy.
+Uses OpenStreetMap's Nominatim search API over a pooled HTTP/2 client.
 """
-from typing import Optional, Tuple
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, Optional, Tuple
+import asyncio
+import json
+import logging
 import os
+import threading
+
+import httpx
+
+try:
+    import redis
+except ImportError:  # Optional dependency, only needed when REDIS_URL is set
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodingServiceError(Exception):
+    """Raised when the geocoding service is unavailable or returns an error."""
 
 
 class GeocodingService:
     """Service for geocoding addresses to GPS coordinates."""
     
-    def __init__(self, user_agent: str = None):
+    MEM_CACHE_MAX_ENTRIES = 1024
+    REDIS_KEY_PREFIX = "geocode:"
+    REDIS_TTL_SECONDS = 30 * 86400
+    NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+    HTTP_TIMEOUT_SECONDS = 10
+    HTTP_MAX_CONNECTIONS = 50
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+    
+    def __init__(self, user_agent: str = None, redis_url: str = None):
         """
         Initialize the geocoding service.
         
         Args:
             user_agent: User agent string for Nominatim API
+            redis_url: Optional Redis URL for a shared coordinates cache
         """
         self.user_agent = user_agent or os.getenv("USER_AGENT", "EXIF-Metadata-Editor/1.0")
-        self.geolocator = Nominatim(user_agent=self.user_agent, timeout=10)
+        # Keep-alive client shared by all lookups, created by open()
+        self._client: Optional[httpx.Client] = None
+    
+        # In-process LRU cache: normalized address -> (latitude, longitude)
+        self._mem_cache: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._mem_cache_lock = threading.Lock()
+        self._redis = self._connect_redis(redis_url or os.getenv("REDIS_URL"))
+    
+        # Lookups currently running, so concurrent requests for the same
+        # address share one Nominatim call (only touched from the event loop)
+        self._inflight: Dict[str, asyncio.Future] = {}
+    
+    @staticmethod
+    def _connect_redis(redis_url: Optional[str]):
+        """Create a Redis client if a URL is configured, otherwise return None."""
+        if not redis_url:
+            return None
+        if redis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using memory cache only")
+            return None
+        try:
+            return redis.Redis.from_url(redis_url, socket_timeout=1, socket_connect_timeout=1)
+        except Exception as e:
+            logger.warning(f"Could not configure Redis geocoding cache: {e}")
+            return None
+    
+    @staticmethod
+    def normalize_address(address: str) -> str:
+        """Normalize an address into a cache key (lowercased, whitespace-collapsed)."""
+        return " ".join(address.lower().split())
+    
+    def _mem_cache_get(self, key: str) -> Optional[Tuple[float, float]]:
+        """Look up coordinates in the in-process LRU."""
+        with self._mem_cache_lock:
+            coordinates = self._mem_cache.get(key)
+            if coordinates is not None:
+                self._mem_cache.move_to_end(key)
+            return coordinates
+    
+    def _cache_get(self, key: str) -> Optional[Tuple[float, float]]:
+        """Look up cached coordinates, memory first then Redis."""
+        coordinates = self._mem_cache_get(key)
+        if coordinates is not None:
+            return coordinates
+        
+        if self._redis is None:
+            return None
+        
+        try:
+            cached = self._redis.get(self.REDIS_KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"Redis geocoding cache read failed: {e}")
+            return None
+        
+        if cached is None:
+            return None
+        
+        try:
+            latitude, longitude = json.loads(cached)
+            coordinates = (float(latitude), float(longitude))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Ignoring malformed Redis geocoding cache entry: {e}")
+            return None
+        
+        self._mem_cache_set(key, coordinates)
+        return coordinates
+    
+    def _mem_cache_set(self, key: str, coordinates: Tuple[float, float]) -> None:
+        """Store coordinates in the in-process LRU, evicting the oldest entry if full."""
+        with self._mem_cache_lock:
+            self._mem_cache[key] = coordinates
+            self._mem_cache.move_to_end(key)
+            if len(self._mem_cache) > self.MEM_CACHE_MAX_ENTRIES:
+                self._mem_cache.popitem(last=False)
     
-    def get_coordinates(self, address: str) -> Optional[Tuple[float, float]]:
+    def _cache_set(self, key: str, coordinates: Tuple[float, float]) -> None:
+        """Store coordinates in both cache layers. Only the two floats are kept."""
+        self._mem_cache_set(key, coordinates)
+        
+        if self._redis is None:
+            return
+        
+        try:
+            self._redis.setex(
+                self.REDIS_KEY_PREFIX + key,
+                self.REDIS_TTL_SECONDS,
+                json.dumps([coordinates[0], coordinates[1]])
+            )
+        except Exception as e:
+            logger.warning(f"Redis geocoding cache write failed: {e}")
+    
+    async def get_coordinates(self, address: str) -> Optional[Tuple[float, float]]:
         """
         Convert an address to GPS coordinates (latitude, longitude).
         
+        Successful lookups are cached in memory and, when configured, in Redis,
+        so repeated addresses skip the Nominatim round-trip. Concurrent calls
+        for the same address wait on a single lookup.
+        
         Args:
             address: Address string to geocode
             
@@ -33,30 +152,104 @@ class GeocodingService:
             
         Raises:
             ValueError: If address is empty or invalid
-            GeocoderServiceError: If the geocoding service is unavailable
+            GeocodingServiceError: If the geocoding service is unavailable
         """
         if not address or not address.strip():
             raise ValueError("Address cannot be empty")
         
+        key = self.normalize_address(address)
+        cached = self._mem_cache_get(key)
+        if cached is not None:
+            return cached
+        
+        lookup = self._inflight.get(key)
+        if lookup is None:
+            # Redis and Nominatim calls are blocking, run them off the event loop
+            lookup = asyncio.ensure_future(asyncio.to_thread(self._lookup, key, address))
+            self._inflight[key] = lookup
+            lookup.add_done_callback(partial(self._lookup_done, key))
+        
+        # Shield so one cancelled request doesn't cancel the shared lookup
+        return await asyncio.shield(lookup)
+    
+    def _lookup_done(self, key: str, lookup: asyncio.Future) -> None:
+        """Forget a finished lookup so later misses start a new one."""
+        if self._inflight.get(key) is lookup:
+            del self._inflight[key]
+        if not lookup.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            lookup.exception()
+    
+    def _lookup(self, key: str, address: str) -> Optional[Tuple[float, float]]:
+        """Resolve an address through Redis, then Nominatim, caching successes."""
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        coordinates = self._geocode(address)
+        if coordinates is not None:
+            self._cache_set(key, coordinates)
+        return coordinates
+    
+    def _geocode(self, address: str) -> Optional[Tuple[float, float]]:
+        """Query Nominatim for an address, retrying once on timeout."""
         try:
-            location = self.geolocator.geocode(address)
+            return self._search(address)
             
-            if location:
-                return (location.latitude, location.longitude)
-            else:
-                return None
-                
-        except GeocoderTimedOut:
+        except httpx.TimeoutException:
             # Retry once on timeout
             try:
-                location = self.geolocator.geocode(address)
-                if location:
-                    return (location.latitude, location.longitude)
-                return None
+                return self._search(address)
             except Exception as e:
-                raise GeocoderServiceError(f"Geocoding service timed out: {str(e)}")
+                raise GeocodingServiceError(f"Geocoding service timed out: {str(e)}")
                 
-        except GeocoderServiceError as e:
-            raise GeocoderServiceError(f"Geocoding service error: {str(e)}")
+        except httpx.HTTPError as e:
+            raise GeocodingServiceError(f"Geocoding service error: {str(e)}")
+        except GeocodingServiceError:
+            raise
+        except RuntimeError as e:
+            # Raised by httpx when the client was closed mid-lookup
+            raise GeocodingServiceError(f"Geocoding service unavailable: {str(e)}")
         except Exception as e:
             raise ValueError(f"Invalid address or geocoding error: {str(e)}")
+
+    def _search(self, address: str) -> Optional[Tuple[float, float]]:
+        """Run a single Nominatim search, keeping only the first result's lat/lon."""
+        client = self._client
+        if client is None:
+            raise GeocodingServiceError("Geocoding service is not started")
+        response = client.get(
+            "/search",
+            params={"q": address, "format": "jsonv2", "limit": 1}
+        )
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return (float(results[0]["lat"]), float(results[0]["lon"]))
+    
+    def open(self) -> None:
+        """
+        Create the pooled HTTP client.
+        
+        Only the first lookup after this pays for the TCP+TLS handshake with
+        Nominatim. Calling open() again after close() starts a fresh client.
+        """
+        if self._client is not None:
+            return
+        self._client = httpx.Client(
+            base_url=self.NOMINATIM_URL,
+            headers={"User-Agent": self.user_agent},
+            http2=True,
+            timeout=self.HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=self.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=self.HTTP_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+    
+    def close(self) -> None:
+        """Close the pooled HTTP connections."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
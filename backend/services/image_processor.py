@@ -1,27 +1,98 @@
 """
 Image processing service for format conversion and EXIF manipulation.
 """
-from PIL import Image
+from PIL import Image, features
+from collections import OrderedDict
+import hashlib
 import io
-from typing import Tuple, Optional
-import piexif
-from .exif_handler import add_gps_to_image
+import logging
+import threading
+from typing import BinaryIO, Tuple, Optional, Union
+import numpy as np
+import os
+from .exif_handler import build_gps_exif_bytes, replace_exif
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+except ImportError:  # Optional dependency, requires the libturbojpeg library
+    TurboJPEG = None
+
+logger = logging.getLogger(__name__)
 
 
 class ImageProcessor:
     """Service for processing images - conversion and EXIF manipulation."""
     
-    SUPPORTED_FORMATS = {"jpeg", "jpg", "png", "webp"}
-    FORMAT_MAPPING = {
-        "jpg": "JPEG",
-        "jpeg": "JPEG",
-        "png": "PNG",
-        "webp": "WEBP"
+    # Normalized format -> (PIL format, MIME type, save parameters)
+    # The defaults favour encode speed: no extra Huffman/zlib tuning passes
+    _JPEG_SAVE_KWARGS = {"format": "JPEG", "quality": 90, "optimize": False, "progressive": False}
+    _FORMAT_TABLE = {
+        "jpeg": ("JPEG", "image/jpeg", _JPEG_SAVE_KWARGS),
+        "jpg": ("JPEG", "image/jpeg", _JPEG_SAVE_KWARGS),
+        "png": ("PNG", "image/png", {"format": "PNG", "compress_level": 6}),
+        "webp": ("WEBP", "image/webp", {"format": "WEBP", "quality": 95}),
+    }
+    SUPPORTED_FORMATS = set(_FORMAT_TABLE)
+    
+    # Extra save parameters for the "best" compression preset, trading
+    # encode time for smaller files
+    _BEST_COMPRESSION_KWARGS = {
+        "JPEG": {"optimize": True, "progressive": True},
+        "PNG": {"optimize": True},
+        "WEBP": {"method": 6},
     }
+    SUPPORTED_COMPRESSIONS = {"fast", "best"}
+    
+    # Decoded image cache, bounded both by entry count and by pixel memory
+    _DECODE_CACHE_MAX = 64
+    _DECODE_CACHE_MAX_BYTES = 512 * 1024 * 1024
     
     def __init__(self):
         """Initialize the image processor."""
-        pass
+        self.check_jpeg_backend()
+        self._tj = self._load_turbojpeg()
+        
+        # Content hash -> decoded image, so repeated uploads skip the decode
+        self._decode_cache: "OrderedDict[bytes, Image.Image]" = OrderedDict()
+        self._decode_cache_bytes = 0
+        self._decode_cache_lock = threading.Lock()
+    
+    @staticmethod
+    def _load_turbojpeg():
+        """
+        Load PyTurboJPEG for direct libjpeg-turbo encodes, if available.
+        
+        Returns:
+            A TurboJPEG instance, or None to always encode through Pillow
+        """
+        if TurboJPEG is None:
+            return None
+        try:
+            return TurboJPEG(os.getenv("TURBOJPEG_LIB") or None)
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"PyTurboJPEG is installed but libturbojpeg could not be loaded: {e}")
+            return None
+    
+    @staticmethod
+    def check_jpeg_backend() -> bool:
+        """
+        Check that Pillow's JPEG codec is libjpeg-turbo.
+        
+        The official Pillow wheels bundle libjpeg-turbo. Source builds link
+        against whatever libjpeg is installed, which can be several times
+        slower for the Image.open/Image.save calls used here.
+        
+        Returns:
+            True if Pillow uses libjpeg-turbo, False otherwise
+        """
+        if features.check_feature("libjpeg_turbo"):
+            return True
+        logger.warning(
+            "Pillow is not linked against libjpeg-turbo; JPEG decode/encode will be slower. "
+            "Install libjpeg-turbo (e.g. libjpeg-turbo8-dev) and reinstall Pillow with "
+            "'pip install --no-binary Pillow --force-reinstall Pillow', or use the official wheels."
+        )
+        return False
     
     def validate_format(self, format_str: str) -> str:
         """
@@ -37,45 +108,116 @@ class ImageProcessor:
             ValueError: If format is not supported
         """
         format_lower = format_str.lower().strip()
-        if format_lower not in self.SUPPORTED_FORMATS:
+        if format_lower not in self._FORMAT_TABLE:
             raise ValueError(
                 f"Unsupported format: {format_str}. "
                 f"Supported formats: {', '.join(self.SUPPORTED_FORMATS)}"
             )
         return format_lower
     
+    def validate_compression(self, compression: str) -> str:
+        """
+        Validate and normalize compression preset.
+        
+        Args:
+            compression: Compression preset (fast, best)
+        
+        Returns:
+            Normalized compression preset
+        
+        Raises:
+            ValueError: If compression preset is not supported
+        """
+        compression_lower = compression.lower().strip()
+        if compression_lower not in self.SUPPORTED_COMPRESSIONS:
+            raise ValueError(
+                f"Unsupported compression: {compression}. "
+                f"Supported compressions: {', '.join(sorted(self.SUPPORTED_COMPRESSIONS))}"
+            )
+        return compression_lower
+    
     def process_image(
         self,
-        image_bytes: bytes,
+        image_source: Union[bytes, BinaryIO],
         latitude: float,
         longitude: float,
-        output_format: str
+        output_format: str,
+        compression: str = "fast",
+        max_dimension: Optional[int] = None
     ) -> Tuple[bytes, str]:
         """
         Process image: convert format and add GPS EXIF data.
         
+        When the input is already in the requested JPEG/WEBP format, the EXIF
+        is spliced into the original file and the pixels are not re-encoded.
+        
         Args:
-            image_bytes: Original image bytes
+            image_source: Original image bytes, or a seekable binary file-like
+                object (e.g. a spooled upload)
             latitude: GPS latitude
             longitude: GPS longitude
             output_format: Desired output format (jpeg, png, webp)
+            compression: "fast" for quick encodes, "best" for smaller files
+                at the cost of extra encoder passes
+            max_dimension: Optional bound for the output width and height;
+                larger images are downscaled, keeping their aspect ratio
             
         Returns:
             Tuple of (processed_image_bytes, mime_type)
             
         Raises:
-            ValueError: If image cannot be processed or format is invalid
+            ValueError: If image cannot be processed or an argument is invalid
         """
         # Validate format
         output_format = self.validate_format(output_format)
-        pil_format = self.FORMAT_MAPPING[output_format]
+        pil_format, mime_type, save_kwargs = self._FORMAT_TABLE[output_format]
+        if self.validate_compression(compression) == "best":
+            save_kwargs = dict(save_kwargs, **self._BEST_COMPRESSION_KWARGS[pil_format])
+        if max_dimension is not None and max_dimension <= 0:
+            raise ValueError("max_dimension must be a positive integer")
+        
+        # Build GPS EXIF data up front (only for JPEG and WEBP)
+        # PNG doesn't support EXIF in the same way, so we skip it
+        exif_bytes = None
+        if pil_format in ("JPEG", "WEBP"):
+            try:
+                exif_bytes = build_gps_exif_bytes(latitude, longitude)
+            except Exception as e:
+                # If EXIF generation fails, return image without EXIF
+                logger.warning(f"Could not add EXIF data: {e}")
         
         try:
-            # Open image
-            image = Image.open(io.BytesIO(image_bytes))
+            # Open image (only parses the header, pixels are decoded lazily)
+            if isinstance(image_source, (bytes, bytearray)):
+                image_source = io.BytesIO(image_source)
+            image = Image.open(image_source)
+            
+            # Target size when the image must be downscaled
+            target_size = None
+            if max_dimension is not None and max(image.size) > max_dimension:
+                ratio = max_dimension / max(image.size)
+                target_size = (
+                    max(1, round(image.width * ratio)),
+                    max(1, round(image.height * ratio))
+                )
+            
+            # Same container in and out: splice the EXIF into the original
+            # bitstream instead of decoding and re-encoding the pixels
+            if exif_bytes is not None and image.format == pil_format and target_size is None:
+                spliced_bytes = self._insert_exif(image_source, exif_bytes)
+                if spliced_bytes is not None:
+                    return spliced_bytes, mime_type
+            
+            # Decode pixels, or reuse a cached decode of identical content
+            image = self._load_image(image, image_source, target_size)
+            if target_size is not None:
+                image.thumbnail(target_size)
             
             # Handle transparency for JPEG conversion
-            if pil_format == "JPEG" and image.mode in ("RGBA", "LA", "P"):
+            if pil_format == "JPEG" and image.mode == "P" and image.palette.mode == "RGB":
+                # Blend the palette with white instead of expanding to RGBA
+                image = self._flatten_palette(image)
+            elif pil_format == "JPEG" and image.mode in ("RGBA", "LA", "P"):
                 # Create white background
                 background = Image.new("RGB", image.size, (255, 255, 255))
                 if image.mode == "P":
@@ -92,52 +234,170 @@ class ImageProcessor:
             # Save image to bytes with new format
             output_buffer = io.BytesIO()
             
-            # Prepare save parameters
-            save_kwargs = {"format": pil_format}
-            
-            if pil_format == "JPEG":
-                save_kwargs["quality"] = 95
-                save_kwargs["optimize"] = True
-            elif pil_format == "PNG":
-                save_kwargs["optimize"] = True
-            elif pil_format == "WEBP":
-                save_kwargs["quality"] = 95
+            # Fast path: RGB JPEG without extra encoder passes goes straight
+            # to libjpeg-turbo, skipping Pillow's encoder plumbing
+            if (self._tj is not None and pil_format == "JPEG" and image.mode == "RGB"
+                    and not save_kwargs.get("optimize") and not save_kwargs.get("progressive")):
+                final_bytes = self._encode_turbojpeg(image, save_kwargs["quality"], exif_bytes)
+                if final_bytes is not None:
+                    return final_bytes, mime_type
             
-            # Save without EXIF first
-            image.save(output_buffer, **save_kwargs)
-            converted_bytes = output_buffer.getvalue()
-            
-            # Add GPS EXIF data (only for JPEG and WEBP)
-            if pil_format in ("JPEG", "WEBP"):
-                try:
-                    exif_bytes = add_gps_to_image(converted_bytes, latitude, longitude)
+            if exif_bytes is not None:
+                save_kwargs = dict(save_kwargs, exif=exif_bytes)
                     
-                    # Re-save with EXIF
-                    output_buffer = io.BytesIO()
-                    image.save(output_buffer, exif=exif_bytes, **save_kwargs)
-                    final_bytes = output_buffer.getvalue()
-                except Exception as e:
-                    # If EXIF injection fails, return image without EXIF
-                    print(f"Warning: Could not add EXIF data: {e}")
-                    final_bytes = converted_bytes
-            else:
-                # PNG doesn't support EXIF in the same way
-                # We'll skip EXIF for PNG
-                final_bytes = converted_bytes
-            
-            # Determine MIME type
-            mime_types = {
-                "JPEG": "image/jpeg",
-                "PNG": "image/png",
-                "WEBP": "image/webp"
-            }
-            mime_type = mime_types.get(pil_format, "application/octet-stream")
+            # Encode once, with EXIF when available
+            image.save(output_buffer, **save_kwargs)
+            final_bytes = output_buffer.getvalue()
             
             return final_bytes, mime_type
             
         except Exception as e:
             raise ValueError(f"Error processing image: {str(e)}")
     
+    def _encode_turbojpeg(
+        self,
+        image: Image.Image,
+        quality: int,
+        exif_bytes: Optional[bytes]
+    ) -> Optional[bytes]:
+        """
+        Encode an RGB image to JPEG with PyTurboJPEG.
+        
+        Args:
+            image: Decoded image in RGB mode
+            quality: JPEG quality (1-100)
+            exif_bytes: Optional EXIF bytes to insert into the result
+        
+        Returns:
+            JPEG bytes, or None if the encode failed (the caller then falls
+            back to Pillow)
+        """
+        try:
+            jpeg_bytes = self._tj.encode(
+                np.asarray(image),
+                quality=quality,
+                pixel_format=TJPF_RGB,
+                jpeg_subsample=TJSAMP_420
+            )
+        except Exception as e:
+            logger.warning(f"TurboJPEG encode failed, falling back to Pillow: {e}")
+            return None
+        
+        if exif_bytes is None:
+            return jpeg_bytes
+        return self._insert_exif(io.BytesIO(jpeg_bytes), exif_bytes)
+    
+    @staticmethod
+    def _flatten_palette(image: Image.Image) -> Image.Image:
+        """
+        Composite a paletted image onto a white background.
+        
+        Transparency is applied to the (at most 256) palette entries rather
+        than to every pixel, so no full-size RGBA buffer is allocated.
+        
+        Args:
+            image: Decoded image in P mode with an RGB palette (modified in place)
+        
+        Returns:
+            The flattened image in RGB mode
+        """
+        transparency = image.info.pop("transparency", None)
+        if transparency is not None:
+            palette = np.array(image.getpalette("RGB"), dtype=np.uint32).reshape(-1, 3)
+            alpha = np.full(len(palette), 255, dtype=np.uint32)
+            if isinstance(transparency, bytes):
+                count = min(len(transparency), len(palette))
+                alpha[:count] = np.frombuffer(transparency, dtype=np.uint8, count=count)
+            elif isinstance(transparency, int) and 0 <= transparency < len(palette):
+                alpha[transparency] = 0
+            palette = (palette * alpha[:, None] + 255 * (255 - alpha[:, None])) // 255
+            image.putpalette(palette.astype(np.uint8).tobytes())
+        return image.convert("RGB")
+    
+    @staticmethod
+    def _content_key(image_file: BinaryIO) -> bytes:
+        """Hash the full content of a seekable binary file."""
+        digest = hashlib.blake2b(digest_size=16)
+        image_file.seek(0)
+        while chunk := image_file.read(1024 * 1024):
+            digest.update(chunk)
+        image_file.seek(0)
+        return digest.digest()
+    
+    def _load_image(
+        self,
+        image: Image.Image,
+        image_file: BinaryIO,
+        draft_size: Optional[Tuple[int, int]] = None
+    ) -> Image.Image:
+        """
+        Decode an opened image, using the decoded image cache.
+        
+        Args:
+            image: Lazily opened image (header parsed, pixels not decoded)
+            image_file: Seekable binary file the image was opened from
+            draft_size: Optional target size; JPEGs are then downscaled by
+                libjpeg during the decode (1/2, 1/4 or 1/8, never below this size)
+        
+        Returns:
+            A decoded image the caller is free to modify
+        """
+        key = self._content_key(image_file)
+        if draft_size is not None:
+            key += b"%dx%d" % draft_size
+        
+        with self._decode_cache_lock:
+            cached = self._decode_cache.get(key)
+            if cached is not None:
+                self._decode_cache.move_to_end(key)
+        if cached is not None:
+            # Cached images are shared, always hand out a copy
+            return cached.copy()
+        
+        if draft_size is not None:
+            # No-op for formats other than JPEG
+            image.draft("RGB", draft_size)
+        image.load()
+        
+        image_size = image.width * image.height * len(image.getbands())
+        if image_size <= self._DECODE_CACHE_MAX_BYTES:
+            with self._decode_cache_lock:
+                if key in self._decode_cache:
+                    return image
+                self._decode_cache[key] = image
+                self._decode_cache_bytes += image_size
+                while (len(self._decode_cache) > self._DECODE_CACHE_MAX
+                       or self._decode_cache_bytes > self._DECODE_CACHE_MAX_BYTES):
+                    _, evicted = self._decode_cache.popitem(last=False)
+                    self._decode_cache_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+            # The cache now shares this image, hand the caller its own copy
+            return image.copy()
+        
+        return image
+    
+    @staticmethod
+    def _insert_exif(image_file: BinaryIO, exif_bytes: bytes) -> Optional[bytes]:
+        """
+        Insert EXIF data into an existing JPEG/WEBP file without re-encoding it.
+        
+        Args:
+            image_file: Seekable binary file containing a JPEG or WEBP image
+            exif_bytes: EXIF bytes to insert (replaces all existing EXIF, XMP
+                and IPTC metadata, so the original location never survives)
+        
+        Returns:
+            The image bytes with EXIF inserted, or None if this file cannot be
+            spliced (the caller then falls back to a full re-encode)
+        """
+        image_file.seek(0)
+        original_bytes = image_file.read()
+        image_file.seek(0)
+        
+        spliced_bytes = replace_exif(original_bytes, exif_bytes)
+        if spliced_bytes is None:
+            logger.warning("Could not insert EXIF without re-encoding, file layout not recognised")
+        return spliced_bytes
+    
     def get_image_info(self, image_bytes: bytes) -> dict:
         """
         Get basic information about an image.
@@ -0,0 +1,122 @@
+"""
+Tests for splicing GPS EXIF into same-format uploads without re-encoding.
+"""
+import io
+import struct
+import unittest
+
+from PIL import Image
+
+from services.exif_handler import build_gps_exif_bytes, read_gps_from_exif
+from services.image_processor import ImageProcessor
+
+LONDON = (51.5074, -0.1278)
+PARIS = (48.8584, 2.2945)
+
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+XMP_PACKET = (
+    b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF><rdf:Description '
+    b'exif:GPSLatitude="51,30.444N" exif:GPSLongitude="0,7.668W"/></rdf:RDF></x:xmpmeta>'
+)
+
+
+def _segment(marker: int, payload: bytes) -> bytes:
+    return bytes((0xFF, marker)) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _chunk(fourcc: bytes, payload: bytes) -> bytes:
+    return fourcc + struct.pack("<I", len(payload)) + payload + b"\x00" * (len(payload) & 1)
+
+
+def _encoded(image_format: str, **save_kwargs) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 40, 90)).save(buffer, image_format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def _jpeg_with_header(*segments: bytes) -> bytes:
+    """Plain JPEG image data behind the given header segments."""
+    data = _encoded("JPEG")
+    # Drop Pillow's own SOI + APP0 and rebuild the header
+    (app0_length,) = struct.unpack_from(">H", data, 4)
+    return b"\xff\xd8" + b"".join(segments) + data[4 + app0_length:]
+
+
+def _webp_with_chunks(*extra_chunks: bytes) -> bytes:
+    """Extended (VP8X) WEBP with the given metadata chunks appended."""
+    data = _encoded("WEBP", lossless=True)
+    assert data[12:16] == b"VP8L"
+    bitstream = data[12:]
+    (bits,) = struct.unpack_from("<I", bitstream, 9)
+    width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    vp8x = struct.pack("<I", 0x0C) + struct.pack("<I", width - 1)[:3] + struct.pack("<I", height - 1)[:3]
+    body = _chunk(b"VP8X", vp8x) + bitstream + b"".join(extra_chunks)
+    return b"RIFF" + struct.pack("<I", len(body) + 4) + b"WEBP" + body
+
+
+class ExifSpliceTests(unittest.TestCase):
+    """The original location must never survive a same-format splice."""
+    
+    def setUp(self):
+        self.processor = ImageProcessor()
+        self.london_exif = build_gps_exif_bytes(*LONDON)
+    
+    def assert_only_new_location(self, original: bytes, output_format: str):
+        result, _ = self.processor.process_image(original, *PARIS, output_format)
+        
+        self.assertEqual(result.count(b"Exif\x00\x00") + result.count(b"EXIF"), 1)
+        self.assertNotIn(XMP_HEADER, result)
+        self.assertNotIn(b"GPSLatitude", result)
+        self.assertNotIn(b"8BIM", result)
+        
+        gps = read_gps_from_exif(result)
+        self.assertAlmostEqual(gps["latitude"], PARIS[0], places=6)
+        self.assertAlmostEqual(gps["longitude"], PARIS[1], places=6)
+        
+        # Pixels are untouched by the splice
+        with Image.open(io.BytesIO(original)) as before, Image.open(io.BytesIO(result)) as after:
+            self.assertEqual(before.tobytes(), after.tobytes())
+        return result
+    
+    def test_jpeg_exif_after_app0_and_icc(self):
+        original = _jpeg_with_header(
+            _segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"),
+            _segment(0xE2, b"ICC_PROFILE\x00\x01\x01" + b"\x00" * 16),
+            _segment(0xE1, self.london_exif),
+        )
+        result = self.assert_only_new_location(original, "jpeg")
+        # JFIF stays first and the ICC profile is kept
+        self.assertEqual(result[6:10], b"JFIF")
+        self.assertIn(b"ICC_PROFILE", result)
+    
+    def test_jpeg_exif_after_xmp(self):
+        original = _jpeg_with_header(
+            _segment(0xE1, XMP_HEADER + XMP_PACKET),
+            _segment(0xE1, self.london_exif),
+        )
+        self.assert_only_new_location(original, "jpeg")
+    
+    def test_jpeg_iptc_is_removed(self):
+        original = _jpeg_with_header(
+            _segment(0xED, b"Photoshop 3.0\x008BIM\x04\x04\x00\x00\x00\x00\x00\x00"),
+            _segment(0xE1, self.london_exif),
+        )
+        self.assert_only_new_location(original, "jpeg")
+    
+    def test_webp_exif_and_xmp_chunks(self):
+        original = _webp_with_chunks(
+            _chunk(b"EXIF", self.london_exif[6:]),
+            _chunk(b"XMP ", XMP_HEADER + XMP_PACKET),
+        )
+        result = self.assert_only_new_location(original, "webp")
+        # VP8X advertises EXIF but no longer XMP
+        self.assertEqual(result[20] & 0x0C, 0x08)
+    
+    def test_simple_webp_gets_extended_header(self):
+        original = _encoded("WEBP", quality=80)
+        result = self.assert_only_new_location(original, "webp")
+        self.assertEqual(result[12:16], b"VP8X")
+
+
+if __name__ == "__main__":
+    unittest.main()